@@ -2,8 +2,11 @@
 """
 FastAPI · Exportador Excel Flora (DwC-SMA · 3 hojas)
 ----------------------------------------------------
-• Endpoint: /export?campana_id=...
-• Devuelve: {"download_url": ".../download/<archivo.xlsx>"}
+• Endpoint: /export?campana_id=...  → genera el Excel en segundo plano
+• Devuelve: {"job_id": ..., "status_url": ".../status/<job_id>", "download_url": ".../download/<archivo.xlsx>"}
+• /status/<job_id>: "pending" | "done" | "error" (descargar cuando esté "done")
+  El estado de los jobs vive en memoria del proceso: /status solo funciona con un único
+  worker de uvicorn, y los jobs terminados se olvidan pasados JOB_TTL_S segundos.
 
 Requisitos:
 - FIREBASE_KEY_B64 (env var) → JSON service account en base64 (una línea)
@@ -11,10 +14,13 @@ Requisitos:
 - Render Free: archivos en /tmp/downloads
 """
 
-import os, re, json, base64, uuid, warnings
+import os, re, json, base64, uuid, warnings, asyncio, stat, tempfile, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional
 from zoneinfo import ZoneInfo
 
 import numpy as np
@@ -23,7 +29,6 @@ import logging
 logger = logging.getLogger("uvicorn.error")
 from fastapi import FastAPI, Query, Request, HTTPException
 from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import compatible con Starlette/Uvicorn
@@ -48,6 +53,9 @@ DOWNLOAD_DIR  = Path("/tmp/downloads")
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 LOCAL_TZ      = ZoneInfo("America/Santiago")
 
+# Plantilla leída una sola vez al importar (cada export la reabre desde memoria)
+TEMPLATE_BYTES = TEMPLATE_PATH.read_bytes() if TEMPLATE_PATH.exists() else None
+
 # ──────────────────────────────── Firebase Init (env)
 B64 = os.environ.get("FIREBASE_KEY_B64")
 if not B64:
@@ -58,6 +66,9 @@ if not firebase_admin._apps:
     firebase_admin.initialize_app(credentials.Certificate(cred_info))
 db = firestore.client()
 
+# Referencias a colecciones, creadas una vez
+COLS = {name: db.collection(name) for name in ("campana", "estacion", "registro")}
+
 # ──────────────────────────────── FastAPI + CORS
 app = FastAPI(title="Exporter Flora · DwC-SMA")
 
@@ -73,79 +84,299 @@ app.add_middleware(
     expose_headers=["Content-Disposition"],
 )
 
-# Opcional: mount estático (no imprescindible si usas /download)
-app.mount("/downloads", StaticFiles(directory=str(DOWNLOAD_DIR)), name="downloads")
-
 # ──────────────────────────────── Utils
 def _safe_filename(s: str) -> str:
     return re.sub(r"[^\w\-]+", "-", str(s)).strip("-") or "file"
 
+def _nombre_salida(campana_id: str) -> str:
+    return f"Flora_{_safe_filename(campana_id)}_{uuid.uuid4().hex[:6]}.xlsx"
+
+def _ensure_str(s: pd.Series) -> pd.Series:
+    """s como texto; sin copiar si ya son todos str (lo normal en ids de Firestore)."""
+    if s.dtype == object and (s.empty or pd.api.types.infer_dtype(s, skipna=False) == "string"):
+        return s
+    return s.astype(str)
+
 def strip_tz(df: pd.DataFrame, tz=LOCAL_TZ) -> pd.DataFrame:
     if df.empty:
         return df
-    for col in df.columns:
-        if pd.api.types.is_datetime64tz_dtype(df[col]):
-            df[col] = df[col].dt.tz_convert(tz).dt.tz_localize(None)
-        elif df[col].dtype == "object":
-            df[col] = df[col].map(
-                lambda v: v.astimezone(tz).replace(tzinfo=None)
-                if isinstance(v, datetime) and v.tzinfo else v
-            )
+    tz_cols = df.select_dtypes(include="datetimetz").columns
+    if len(tz_cols):
+        df[tz_cols] = df[tz_cols].apply(lambda s: s.dt.tz_convert(tz).dt.tz_localize(None))
+    for col in df.select_dtypes(include="object").columns:
+        # solo columnas que pueden traer datetimes (las de texto/números se saltan)
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ("datetime", "mixed", "mixed-integer"):
+            continue
+        df[col] = df[col].map(
+            lambda v: v.astimezone(tz).replace(tzinfo=None)
+            if isinstance(v, datetime) and v.tzinfo else v
+        )
     return df
 
+PAGE_SIZE = 500   # docs por página en las lecturas de Firestore
+
 def fetch_by_campana(collection: str, campana_id: str) -> pd.DataFrame:
     campana_id = str(campana_id).strip('"')
-    ref = db.collection(collection).where("campanaID", "==", campana_id)
-    rows = []
-    for d in ref.stream():
-        data = d.to_dict() or {}
-        data["id"] = d.id
-        rows.append(data)
+    base = COLS[collection].where("campanaID", "==", campana_id)
+    base = base.select(CAMPOS_FIRESTORE[collection])
+    base = base.order_by("__name__").limit(PAGE_SIZE)
+
+    # leer por páginas de PAGE_SIZE docs (cursor sobre el id del último doc)
+    rows, query = [], base
+    while True:
+        page = query.get()
+        rows.extend({**(d.to_dict() or {}), "id": d.id} for d in page)
+        if len(page) < PAGE_SIZE:
+            break
+        query = base.start_after(page[-1])
     return strip_tz(pd.DataFrame(rows))
 
-def get_lat(p):
-    if p is None or (isinstance(p, float) and np.isnan(p)):
-        return None
-    return p.get("latitude") if isinstance(p, dict) else getattr(p, "latitude", None)
+def _columna(df: pd.DataFrame, col: Optional[str]) -> np.ndarray:
+    """Columna `col` de df como array object, con None donde no hay dato."""
+    if col is None or col not in df.columns:
+        return np.full(len(df), None, dtype=object)
+    s = df[col]
+    return s.astype(object).where(s.notna(), None).to_numpy()
+
+def _extract_latlon(valores) -> tuple[np.ndarray, np.ndarray]:
+    """Latitudes y longitudes (GeoPoint o dict) en una sola pasada; None si no hay punto."""
+    arr  = np.asarray(valores, dtype=object)
+    lats = np.full(len(arr), None, dtype=object)
+    lons = np.full(len(arr), None, dtype=object)
+    for i, p in enumerate(arr):
+        if isinstance(p, dict):
+            lats[i] = p.get("latitude")
+            lons[i] = p.get("longitude")
+        elif p is not None and not (isinstance(p, float) and p != p):
+            lats[i] = getattr(p, "latitude", None)
+            lons[i] = getattr(p, "longitude", None)
+    return lats, lons
+
+def _escribir_filas(ws, start_row: int, columnas: tuple[tuple[int, str], ...], df: pd.DataFrame) -> None:
+    """Vuelca df en ws desde start_row (matriz por posición); columnas = [(n° columna, nombre), ...]."""
+    numeros = [n for n, _ in columnas]
+    sub     = df[[c for _, c in columnas]]
+    # NaN / <NA> de las columnas tipadas → celda vacía
+    matriz  = sub.astype(object).where(sub.notna(), None).to_numpy()
+    cell    = ws.cell
+    for r, fila in enumerate(matriz.tolist(), start=start_row):
+        for col_number, v in zip(numeros, fila):
+            if v is not None:   # las filas de datos de la plantilla vienen vacías: no crear Cell
+                cell(row=r, column=col_number, value=v)
+
+# ──────────────────────────────── Mapeos plantilla (DwC-SMA)
+# Hoja "Campaña"
+CAMPANA_MAP = {
+    "Nombre campaña":    "name",
+    "Número de campaña": "ncampana",
+    "Fecha inicio":      "startDateCamp",
+    "Fecha término":     "endDateCamp",
+}
+NUMEROS_CAMPANA = {
+    "ID Campaña":               1,
+    "Nombre campaña":           2,
+    "Número de campaña":        3,
+    "Año inicio":               4,
+    "Mes inicio":               5,
+    "Día inicio":               6,
+    "Año término":              7,
+    "Mes término":              8,
+    "Día término":              9,
+    "Objetivo de la campaña":   10,
+    "Comentarios adicionales":  11,
+}
+
+# Hoja "EstacionReplica"
+ESTACION_MAP = {
+    "ID Campaña":                  None,
+    "Nombre estación":             "name",
+    "Tipo de monitoreo":           "tipoMonitoreo",
+    "Número Réplica":              None,             # se rellena
+    "Descripción EstacionReplica": "comentario",
+    "Superficie (m2)":             "tamano",
+    "Latitud decimal central":     "coordinatesPlani",
+    "Longitud decimal central":    "coordinatesPlani",
+    "Región":                      "region",
+    "Provincia":                   "provincia",
+    "Comuna":                      "comuna",
+    "Localidad":                   "localidad",
+    "Ecosistema nivel 1":          "cobertura1",
+    "Ecosistema nivel 2":          "cobertura2",
+    "estacionID":                  "estacionID",
+}
+NUMEROS_ESTACION = {
+    "ID Campaña": 1,
+    "Nombre estación": 2,
+    "Tipo de monitoreo": 3,
+    "Número Réplica": 4,
+    "Descripción EstacionReplica": 5,
+    "Superficie (m2)": 9,
+    "Latitud decimal central": 10,
+    "Longitud decimal central": 11,
+    "Región": 16,
+    "Provincia": 17,
+    "Comuna": 18,
+    "Localidad": 19,
+    "Ecosistema nivel 1": 20,
+    "Ecosistema nivel 2": 21,
+}
+
+# Hoja "Ocurrencia" (REGISTRO)
+REGISTRO_MAP = {
+    "ID Campaña": None,
+    "AUTOCOMPLETADO NombreCampaña": "valor",
+    "ID EstacionReplica": "Número Réplica",
+    "AUTOCOMPLETADO NombreEstacion-Número Replica-Tipo de monitoreo": None,
+    "Año del evento": "registroAnoDate",
+    "Mes del evento": "registrosMesDate",
+    "Día del evento": "registrosDiaDate",
+    "Hora inicio evento (hh:mm)": "registrosHoraDate",
+    "Protocolo de muestreo": "protocoloMuestreo",
+    "Tamaño de la muestra": "tamanoEst",
+    "Unidad del tamaño de la muestra": "unidadDeLaMuestra",
+    "Esfuerzo de muestreo": None,
+    "Profundidad (m)":  None,
+    "Comentarios del evento": "comentarios",
+    "Reino": "Reino",
+    "Filo o división": None,
+    "Clase": "clase",
+    "Orden":  None,
+    "Familia": "familia",
+    "Género": "genero",
+    "Subgénero": None,
+    "Epíteto específico": None,
+    "Epíteto infraespecífico": None,
+    "Nombre común":  None,
+    "Comentarios del taxón":  None,
+    "Estado del organismo": "estadoDelOrganismo",
+    "Tipo de componente abiótico": "tipoDeComponente",
+    "Parámetro": "parametro",
+    "Tipo de cuantificación": "tipoCuantificacion",
+    "Valor": "nInd",
+    "Unidad de valor": "unidadDeValor",
+    "Latitud decimal registro": "coordinatesReg",
+    "Longitud decimal registro": "coordinatesReg",
+    "Hora registro": "registrosHoraDate",
+    "Condición reproductiva": None,
+    "Sexo (Fauna)": None,
+    "Etapa de vida (Fauna)": None,
+    "Comportamiento (Fauna)": None,
+    "Hábito de crecimiento (Flora)": "habito",
+    "Propiedades dinámicas": "valor",
+    "Tipo de registro": "tipoDeRegistro",
+    "Código individuo": None,
+    "Comentarios del registro biológico": None,
+    "Muestreado por": None,
+    "Identificado por": None,
+    "Comentarios de la Identificación": None,
+    "Observaciones adicionales": None,
+}
+
+# Punto E: DEJADO APOSTA con clave 43 duplicada (se conserva tal cual)
+NUMERO_REGISTRO = {
+    1: "ID Campaña",
+    2: "AUTOCOMPLETADO NombreCampaña",
+    3: "ID EstacionReplica",
+    4: "AUTOCOMPLETADO NombreEstacion-Número Replica-Tipo de monitoreo",
+    5: "Año del evento",
+    6: "Mes del evento",
+    7: "Día del evento",
+    8: "Hora inicio evento (hh:mm)",
+    9: "Protocolo de muestreo",
+    10: "Tamaño de la muestra",
+    11: "Unidad del tamaño de la muestra",
+    12: "Esfuerzo de muestreo",
+    13: "Profundidad (m)",
+    14: "Comentarios del evento",
+    15: "Reino",
+    16: "Filo o división",
+    17: "Clase",
+    18: "Orden",
+    19: "Familia",
+    20: "Género",
+    21: "Subgénero",
+    22: "Epíteto específico",
+    23: "Epíteto infraespecífico",
+    24: "Nombre común",
+    25: "Comentarios del taxón",
+    26: "Estado del organismo",
+    27: "Tipo de componente abiótico",
+    28: "Parámetro",
+    29: "Tipo de cuantificación",
+    30: "Valor",
+    31: "Unidad de valor",
+    32: "Latitud decimal registro",
+    33: "Longitud decimal registro",
+    34: "Hora registro",
+    35: "Condición reproductiva",
+    36: "Sexo (Fauna)",
+    37: "Etapa de vida (Fauna)",
+    38: "Comportamiento (Fauna)",
+    39: "Hábito de crecimiento (Flora)",
+    40: "Propiedades dinámicas",
+    41: "Tipo de registro",
+    42: "Código individuo",
+    43: "Comentarios del registro biológico",
+    43: "Muestreado por",   # ← duplicado intencional
+    45: "Identificado por",
+    46: "Comentarios de la Identificación",
+    47: "Observaciones adicionales",
+}
+
+# campos sin fuente → " " (el resto de los sin fuente quedan vacíos)
+CAMPOS_EN_BLANCO = {
+    "Esfuerzo de muestreo", "Profundidad (m)", "Filo o división", "Orden", "Subgénero",
+    "Epíteto específico", "Epíteto infraespecífico", "Nombre común", "Comentarios del taxón",
+    "Condición reproductiva", "Sexo (Fauna)", "Etapa de vida (Fauna)", "Comportamiento (Fauna)",
+    "Código individuo", "Comentarios del registro biológico", "Muestreado por",
+    "Identificado por", "Comentarios de la Identificación", "Observaciones adicionales",
+}
+
+# Columnas con fórmulas en la plantilla (no se pisan)
+FORMULA_COLS = {
+    "AUTOCOMPLETADO NombreCampaña",  # Columna B (n° 1 en tu mapeo)
+    "AUTOCOMPLETADO NombreEstacion-Número Replica-Tipo de monitoreo",  # Columna D (n° 3)
+}
+
+# Orden de escritura por hoja: (n° columna, nombre), precalculado una vez
+CAMPANA_WRITE_ORDER  = tuple((n, c) for c, n in NUMEROS_CAMPANA.items())
+ESTACION_WRITE_ORDER = tuple((n, c) for c, n in NUMEROS_ESTACION.items())
+REGISTRO_WRITE_ORDER = tuple(
+    (n, c) for n, c in sorted(NUMERO_REGISTRO.items()) if c not in FORMULA_COLS
+)
 
-def get_lon(p):
-    if p is None or (isinstance(p, float) and np.isnan(p)):
-        return None
-    return p.get("longitude") if isinstance(p, dict) else getattr(p, "longitude", None)
+# Campos que se usan de cada colección (el resto no se descarga), derivados de los mapeos;
+# "Número Réplica" se calcula y estacionID se necesita para cruzar registro con estación
+CAMPOS_FIRESTORE = {
+    "campana":  sorted({v for v in CAMPANA_MAP.values() if v}),
+    "estacion": sorted({v for v in ESTACION_MAP.values() if v}),
+    "registro": sorted({v for v in REGISTRO_MAP.values() if v} - {"Número Réplica"} | {"estacionID"}),
+}
 
 # ──────────────────────────────── Generación de Excel
-def generar_excel_fauna_like(campana_id: str) -> Path:
-    # 1) Leer datos de Firestore (flora: campana/estacion/registro)
-    df_campana  = fetch_by_campana("campana",  campana_id)
-    df_estacion = fetch_by_campana("estacion", campana_id)
-    df_registro = fetch_by_campana("registro", campana_id)
+def generar_excel_fauna_like(campana_id: str, out_name: Optional[str] = None) -> Path:
+    # 1) Leer datos de Firestore (flora: campana/estacion/registro), las 3 consultas en paralelo
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        df_campana, df_estacion, df_registro = pool.map(
+            lambda collection: fetch_by_campana(collection, campana_id),
+            ("campana", "estacion", "registro"),
+        )
 
     if df_campana.empty:
         raise HTTPException(status_code=404, detail="No hay documentos en 'campana' para ese campanaID.")
     # Nota: si estación o registro están vacíos, igual generamos el archivo con las hojas vacías.
 
     # ───── Hoja "Campaña" (DF plantilla)
-    CAMPANA_MAP = {
-        "Nombre campaña":    "name",
-        "Número de campaña": "ncampana",
-        "Fecha inicio":      "startDateCamp",
-        "Fecha término":     "endDateCamp",
-    }
-    camp = df_campana.iloc[0].to_dict()
-    _to_dt = lambda v: pd.to_datetime(v, errors="coerce")
-    dt_ini = _to_dt(camp.get(CAMPANA_MAP["Fecha inicio"]))
-    dt_fin = _to_dt(camp.get(CAMPANA_MAP["Fecha término"]))
+    camp = df_campana.iloc[0]   # Series: .get() por etiqueta, sin pasar por dict
 
-    def _ymd(dt: Any):
-        if pd.isna(dt):
-            return None, None, None
-        try:
-            return int(dt.year), int(dt.month), int(dt.day)
-        except Exception:
+    def _ymd(v: Any):
+        ts = pd.to_datetime(v, errors="coerce")   # None → None, no parseable → NaT
+        if ts is None or ts is pd.NaT:
             return None, None, None
+        return ts.year, ts.month, ts.day
 
-    anio_ini, mes_ini, dia_ini = _ymd(dt_ini)
-    anio_fin, mes_fin, dia_fin = _ymd(dt_fin)
+    anio_ini, mes_ini, dia_ini = _ymd(camp.get(CAMPANA_MAP["Fecha inicio"]))
+    anio_fin, mes_fin, dia_fin = _ymd(camp.get(CAMPANA_MAP["Fecha término"]))
 
     df_campana_plantilla = pd.DataFrame([{
         "ID Campaña":               1,
@@ -159,74 +390,30 @@ def generar_excel_fauna_like(campana_id: str) -> Path:
         "Día término":              dia_fin,
         "Objetivo de la campaña":   None,
         "Comentarios adicionales":  None,
-    }])
-
-    numeros_campana = {
-        "ID Campaña":               1,
-        "Nombre campaña":           2,
-        "Número de campaña":        3,
-        "Año inicio":               4,
-        "Mes inicio":               5,
-        "Día inicio":               6,
-        "Año término":              7,
-        "Mes término":              8,
-        "Día término":              9,
-        "Objetivo de la campaña":   10,
-        "Comentarios adicionales":  11,
-    }
+    }]).astype({
+        "Año inicio":  "Int16", "Mes inicio":  "Int8", "Día inicio":  "Int8",
+        "Año término": "Int16", "Mes término": "Int8", "Día término": "Int8",
+    })
 
     # ───── Hoja "EstacionReplica"
-    ESTACION_MAP = {
-        "ID Campaña":                  None,
-        "Nombre estación":             "name",
-        "Tipo de monitoreo":           "tipoMonitoreo",
-        "Número Réplica":              None,             # se rellena
-        "Descripción EstacionReplica": "comentario",
-        "Superficie (m2)":             "tamano",
-        "Latitud decimal central":     "coordinatesPlani",
-        "Longitud decimal central":    "coordinatesPlani",
-        "Región":                      "region",
-        "Provincia":                   "provincia",
-        "Comuna":                      "comuna",
-        "Localidad":                   "localidad",
-        "Ecosistema nivel 1":          "cobertura1",
-        "Ecosistema nivel 2":          "cobertura2",
-        "estacionID":                  "estacionID",
-    }
-    numeros_estacion = {
-        "ID Campaña": 1,
-        "Nombre estación": 2,
-        "Tipo de monitoreo": 3,
-        "Número Réplica": 4,
-        "Descripción EstacionReplica": 5,
-        "Superficie (m2)": 9,
-        "Latitud decimal central": 10,
-        "Longitud decimal central": 11,
-        "Región": 16,
-        "Provincia": 17,
-        "Comuna": 18,
-        "Localidad": 19,
-        "Ecosistema nivel 1": 20,
-        "Ecosistema nivel 2": 21,
+    # columnas completas de una vez (sin asignar celda a celda)
+    n_est = len(df_estacion)
+    lat_est, lon_est = _extract_latlon(_columna(df_estacion, "coordinatesPlani"))
+    cols_estacion = {
+        col_name: _columna(df_estacion, col)
+        for col_name, col in ESTACION_MAP.items()
+        if col != "coordinatesPlani"
     }
-
-    df_estacion_columns   = list(ESTACION_MAP.keys())
-    df_estacion_plantilla = pd.DataFrame(columns=df_estacion_columns)
-    for i, src in df_estacion.reset_index(drop=True).iterrows():
-        id_row = i + 1
-        for col_name in df_estacion_columns:
-            col = ESTACION_MAP.get(col_name)
-            if col_name == "ID Campaña":
-                cellValue = id_row
-            elif col_name == "Número Réplica":
-                cellValue = 0   # se rellena con cumcount
-            elif col_name == "Latitud decimal central":
-                cellValue = get_lat(src[col]) if (col in src and pd.notna(src[col])) else None
-            elif col_name == "Longitud decimal central":
-                cellValue = get_lon(src[col]) if (col in src and pd.notna(src[col])) else None
-            else:
-                cellValue = src[col] if (col is not None and col in src and pd.notna(src[col])) else None
-            df_estacion_plantilla.loc[i, col_name] = cellValue
+    cols_estacion.update({
+        "ID Campaña":               np.arange(1, n_est + 1),
+        "Número Réplica":           0,   # se rellena con cumcount
+        "Latitud decimal central":  lat_est,
+        "Longitud decimal central": lon_est,
+    })
+    df_estacion_plantilla = pd.DataFrame(cols_estacion, index=range(n_est), columns=list(ESTACION_MAP)).astype({
+        "Latitud decimal central":  "float64",
+        "Longitud decimal central": "float64",
+    })
 
     # réplicas por estación
     if not df_estacion_plantilla.empty:
@@ -234,199 +421,107 @@ def generar_excel_fauna_like(campana_id: str) -> Path:
             df_estacion_plantilla.groupby("Nombre estación").cumcount().add(1)
         )
 
-    # ───── Hoja "Ocurrencia" (REGISTRO) + join con Número Réplica
+    # ───── Hoja "Ocurrencia" (REGISTRO) + Número Réplica por estacionID
     if "estacionID" in df_estacion_plantilla.columns and "estacionID" in df_registro.columns:
-        df_estacion_plantilla["estacionID"] = df_estacion_plantilla["estacionID"].astype(str)
-        df_registro["estacionID"]           = df_registro["estacionID"].astype(str)
-        df_registro = df_registro.merge(
-            df_estacion_plantilla[["estacionID", "Número Réplica"]],
-            on="estacionID",
-            how="left",
-        )
+        df_estacion_plantilla["estacionID"] = _ensure_str(df_estacion_plantilla["estacionID"])
+        df_registro["estacionID"]           = _ensure_str(df_registro["estacionID"])
+        replica_por_estacion = dict(zip(
+            df_estacion_plantilla["estacionID"], df_estacion_plantilla["Número Réplica"]
+        ))
+        df_registro["Número Réplica"] = df_registro["estacionID"].map(replica_por_estacion)
     else:
         df_registro["Número Réplica"] = None
 
-    REGISTRO_MAP = {
-        "ID Campaña": None,
-        "AUTOCOMPLETADO NombreCampaña": "valor",
-        "ID EstacionReplica": "Número Réplica",
-        "AUTOCOMPLETADO NombreEstacion-Número Replica-Tipo de monitoreo": None,
-        "Año del evento": "registroAnoDate",
-        "Mes del evento": "registrosMesDate",
-        "Día del evento": "registrosDiaDate",
-        "Hora inicio evento (hh:mm)": "registrosHoraDate",
-        "Protocolo de muestreo": "protocoloMuestreo",
-        "Tamaño de la muestra": "tamanoEst",
-        "Unidad del tamaño de la muestra": "unidadDeLaMuestra",
-        "Esfuerzo de muestreo": None,
-        "Profundidad (m)":  None,
-        "Comentarios del evento": "comentarios",
-        "Reino": "Reino",
-        "Filo o división": None,
-        "Clase": "clase",
-        "Orden":  None,
-        "Familia": "familia",
-        "Género": "genero",
-        "Subgénero": None,
-        "Epíteto específico": None,
-        "Epíteto infraespecífico": None,
-        "Nombre común":  None,
-        "Comentarios del taxón":  None,
-        "Estado del organismo": "estadoDelOrganismo",
-        "Tipo de componente abiótico": "tipoDeComponente",
-        "Parámetro": "parametro",
-        "Tipo de cuantificación": "tipoCuantificacion",
-        "Valor": "nInd",
-        "Unidad de valor": "unidadDeValor",
-        "Latitud decimal registro": "coordinatesReg",
-        "Longitud decimal registro": "coordinatesReg",
-        "Hora registro": "registrosHoraDate",
-        "Condición reproductiva": None,
-        "Sexo (Fauna)": None,
-        "Etapa de vida (Fauna)": None,
-        "Comportamiento (Fauna)": None,
-        "Hábito de crecimiento (Flora)": "habito",
-        "Propiedades dinámicas": "valor",
-        "Tipo de registro": "tipoDeRegistro",
-        "Código individuo": None,
-        "Comentarios del registro biológico": None,
-        "Muestreado por": None,
-        "Identificado por": None,
-        "Comentarios de la Identificación": None,
-        "Observaciones adicionales": None,
-    }
-
-    # Punto E: DEJADO APOSTA con clave 43 duplicada (se conserva tal cual)
-    numero_registro = {
-        1: "ID Campaña",
-        2: "AUTOCOMPLETADO NombreCampaña",
-        3: "ID EstacionReplica",
-        4: "AUTOCOMPLETADO NombreEstacion-Número Replica-Tipo de monitoreo",
-        5: "Año del evento",
-        6: "Mes del evento",
-        7: "Día del evento",
-        8: "Hora inicio evento (hh:mm)",
-        9: "Protocolo de muestreo",
-        10: "Tamaño de la muestra",
-        11: "Unidad del tamaño de la muestra",
-        12: "Esfuerzo de muestreo",
-        13: "Profundidad (m)",
-        14: "Comentarios del evento",
-        15: "Reino",
-        16: "Filo o división",
-        17: "Clase",
-        18: "Orden",
-        19: "Familia",
-        20: "Género",
-        21: "Subgénero",
-        22: "Epíteto específico",
-        23: "Epíteto infraespecífico",
-        24: "Nombre común",
-        25: "Comentarios del taxón",
-        26: "Estado del organismo",
-        27: "Tipo de componente abiótico",
-        28: "Parámetro",
-        29: "Tipo de cuantificación",
-        30: "Valor",
-        31: "Unidad de valor",
-        32: "Latitud decimal registro",
-        33: "Longitud decimal registro",
-        34: "Hora registro",
-        35: "Condición reproductiva",
-        36: "Sexo (Fauna)",
-        37: "Etapa de vida (Fauna)",
-        38: "Comportamiento (Fauna)",
-        39: "Hábito de crecimiento (Flora)",
-        40: "Propiedades dinámicas",
-        41: "Tipo de registro",
-        42: "Código individuo",
-        43: "Comentarios del registro biológico",
-        43: "Muestreado por",   # ← duplicado intencional
-        45: "Identificado por",
-        46: "Comentarios de la Identificación",
-        47: "Observaciones adicionales",
+    # Construir df_registro_plantilla (columna a columna)
+    n_reg = len(df_registro)
+    lat_reg, lon_reg = _extract_latlon(_columna(df_registro, "coordinatesReg"))
+    # columnas constantes como escalares: pandas las expande a todo el índice
+    cols_registro = {
+        col_name: _columna(df_registro, col) if col is not None else None
+        for col_name, col in REGISTRO_MAP.items()
+        if col != "coordinatesReg"
     }
-
-    # Construir df_registro_plantilla
-    df_registro_plantilla = pd.DataFrame()
-    df_registro_columns   = list(REGISTRO_MAP.keys())
-
-    for i in range(len(df_registro)):
-        for col_name in df_registro_columns:
-            col = REGISTRO_MAP.get(col_name)
-            if col_name == "ID Campaña":
-                cellValue = 1
-            elif col_name == "Latitud decimal registro":
-                cellValue = get_lat(df_registro[col][i]) if (col in df_registro and pd.notna(df_registro[col][i])) else None
-            elif col_name == "Longitud decimal registro":
-                cellValue = get_lon(df_registro[col][i]) if (col in df_registro and pd.notna(df_registro[col][i])) else None
-            elif col_name in {"Muestreado por" , "Identificado por"}:
-                cellValue = "AMS Consultores"
-            elif col is None:
-                # campos sin fuente → dejar vacío (o " " si prefieres)
-                cellValue = " " if col_name in {
-                    "Esfuerzo de muestreo", "Profundidad (m)", "Filo o división", "Orden", "Subgénero",
-                    "Epíteto específico", "Epíteto infraespecífico", "Nombre común", "Comentarios del taxón",
-                    "Condición reproductiva", "Sexo (Fauna)", "Etapa de vida (Fauna)", "Comportamiento (Fauna)",
-                    "Código individuo", "Comentarios del registro biológico", "Muestreado por",
-                    "Identificado por", "Comentarios de la Identificación", "Observaciones adicionales",
-                } else None
-            else:
-                cellValue = df_registro.loc[i, col] if (col in df_registro.columns and pd.notna(df_registro.loc[i, col])) else None
-
-            df_registro_plantilla.loc[i, col_name] = cellValue
+    for col_name in CAMPOS_EN_BLANCO:
+        cols_registro[col_name] = " "
+    cols_registro.update({
+        "ID Campaña":                1,
+        "Latitud decimal registro":  lat_reg,
+        "Longitud decimal registro": lon_reg,
+        "Muestreado por":            "AMS Consultores",
+        "Identificado por":          "AMS Consultores",
+    })
+    df_registro_plantilla = pd.DataFrame(cols_registro, index=range(n_reg), columns=list(REGISTRO_MAP)).astype({
+        "ID EstacionReplica":        "Int64",
+        "Latitud decimal registro":  "float64",
+        "Longitud decimal registro": "float64",
+    })
 
     # ───── Escribir a Excel
-    if not TEMPLATE_PATH.exists():
+    if TEMPLATE_BYTES is None:
         raise HTTPException(status_code=500, detail=f"No se encontró la plantilla: {TEMPLATE_PATH.name}")
 
-    wb = load_workbook(TEMPLATE_PATH)
+    wb = load_workbook(BytesIO(TEMPLATE_BYTES))
     wc = wb["Campaña"]
     ws = wb["EstacionReplica"]
     wo = wb["Ocurrencia"]
 
     # Campaña (fila 3)
-    for r in range(3, len(df_campana_plantilla) + 3):
-        for col_name, col_number in numeros_campana.items():
-            v = df_campana_plantilla.loc[r - 3, col_name]
-            wc.cell(row=r, column=col_number, value=v)
+    _escribir_filas(wc, 3, CAMPANA_WRITE_ORDER, df_campana_plantilla)
 
     # EstacionReplica (borrar previas y desde fila 2)
     if ws.max_row > 1:
         ws.delete_rows(2, ws.max_row - 1)
-    for r in range(2, len(df_estacion_plantilla) + 2):
-        for col_name, col_number in numeros_estacion.items():
-            v = df_estacion_plantilla.loc[r - 2, col_name] if not df_estacion_plantilla.empty else None
-            ws.cell(row=r, column=col_number, value=v)
-
-    # Ocurrencia (borrar previas y desde fila 3)
-    start_row = 3
-    FORMULA_COLS = {
-    "AUTOCOMPLETADO NombreCampaña",  # Columna B (n° 1 en tu mapeo)
-    "AUTOCOMPLETADO NombreEstacion-Número Replica-Tipo de monitoreo",  # Columna D (n° 3)
-    }
-
-    for r in range(start_row, len(df_registro_plantilla) + start_row):
-        for col_number in sorted(numero_registro.keys()):
-            col_name = numero_registro[col_number]
+    _escribir_filas(ws, 2, ESTACION_WRITE_ORDER, df_estacion_plantilla)
 
-            # No pisar las columnas que tienen fórmulas en la plantilla
-            if col_name in FORMULA_COLS:
-                continue
+    # Ocurrencia (desde fila 3; REGISTRO_WRITE_ORDER ya excluye las columnas con fórmulas)
+    _escribir_filas(wo, 3, REGISTRO_WRITE_ORDER, df_registro_plantilla)
 
-            v = (
-                df_registro_plantilla.loc[r - start_row, col_name]
-                if not df_registro_plantilla.empty
-                else None
-            )
-            wo.cell(row=r, column=col_number, value=v)
+    # Guardar a /tmp/downloads: primero a un temporal oculto (".…part", fuera de lo que sirve
+    # /download) y luego rename, así nunca se descarga un archivo a medias
+    out_path = DOWNLOAD_DIR / (out_name or _nombre_salida(campana_id))
+    with tempfile.NamedTemporaryFile(dir=DOWNLOAD_DIR, prefix=".", suffix=".part", delete=False) as tmp:
+        tmp_path = Path(tmp.name)
+    try:
+        wb.save(tmp_path)
+        tmp_path.replace(out_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)   # si wb.save falla no queda basura
+    return out_path
 
+# ──────────────────────────────── Jobs (exportación en segundo plano)
+JOBS: OrderedDict[str, dict] = OrderedDict()     # job_id → {"status", "campana_id", "filename", ["status_code", "detail"]}
+_JOB_FIN: dict[str, float] = {}  # job_id → time.monotonic() al terminar (para el TTL)
+_TAREAS: set = set()             # referencias a las tareas en curso (evita que el GC las cancele)
+JOB_TTL_S = 60 * 60              # los jobs terminados se olvidan pasada 1 hora
+
+def _purgar_jobs() -> None:
+    """Olvida los jobs terminados hace más de JOB_TTL_S (se llama al registrar uno nuevo)."""
+    limite = time.monotonic() - JOB_TTL_S
+    for job_id in [j for j, fin in _JOB_FIN.items() if fin < limite]:
+        JOBS.pop(job_id, None)
+        del _JOB_FIN[job_id]
+
+async def _run_export(job_id: str, campana_id: str, out_name: str) -> None:
+    job = JOBS[job_id]
+    try:
+        out_path = await asyncio.to_thread(generar_excel_fauna_like, campana_id, out_name)
+        logger.info(f"[EXPORT] Excel generado en: {out_path}")
+        job["status"] = "done"
+    except HTTPException as he:
+        logger.error(f"[EXPORT] HTTPException: {he.detail}")
+        # se conserva el status_code para que el cliente lo vea en /status
+        job.update(status="error", status_code=he.status_code, detail=he.detail)
+    except Exception as e:
+        logger.exception("[EXPORT] Error no controlado generando Excel")
+        job.update(status="error", status_code=500, detail=f"Error generando Excel: {e}")
+    finally:
+        _JOB_FIN[job_id] = time.monotonic()
 
-    # Guardar a /tmp/downloads
-    out_name = f"Flora_{_safe_filename(campana_id)}_{uuid.uuid4().hex[:6]}.xlsx"
-    out_path = DOWNLOAD_DIR / out_name
-    wb.save(out_path)
-    return out_path
+def _url_publica(request: Request, name: str, **path_params) -> str:
+    proto = request.headers.get("x-forwarded-proto", request.url.scheme)
+    host  = request.headers.get("host", request.url.netloc)
+    rel   = request.url_for(name, **path_params).path
+    return f"{proto}://{host}{rel}"
 
 # ──────────────────────────────── Endpoints
 @app.get("/health")
@@ -434,34 +529,59 @@ def health():
     return {"ok": True}
 
 @app.get("/export")
-def export_excel(
+async def export_excel(
     request: Request,
     campana_id: str = Query(..., description="campanaID a exportar"),
 ):
     logger.info(f"[EXPORT] Llamado a /export con campana_id={campana_id!r}")
-    try:
-        out_path = generar_excel_fauna_like(campana_id)
-        logger.info(f"[EXPORT] Excel generado en: {out_path}")
-    except HTTPException as he:
-        logger.error(f"[EXPORT] HTTPException: {he.detail}")
-        # re-lanzamos tal cual para que el cliente vea el status_code
-        raise
-    except Exception as e:
-        logger.exception("[EXPORT] Error no controlado generando Excel")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error generando Excel: {e}",
-        )
+    job_id   = uuid.uuid4().hex
+    out_name = _nombre_salida(campana_id)
+    _purgar_jobs()
+    JOBS[job_id] = {"status": "pending", "campana_id": campana_id, "filename": out_name}
 
-    proto = request.headers.get("x-forwarded-proto", request.url.scheme)
-    host  = request.headers.get("host", request.url.netloc)
-    rel   = request.url_for("download_file", fname=out_path.name).path
-    download_url = f"{proto}://{host}{rel}"
+    # la generación corre en un thread; el event loop queda libre para otras requests
+    task = asyncio.create_task(_run_export(job_id, campana_id, out_name))
+    _TAREAS.add(task)
+    task.add_done_callback(_TAREAS.discard)
 
-    logger.info(f"[EXPORT] URL de descarga generada: {download_url}")
+    status_url   = _url_publica(request, "job_status", job_id=job_id)
+    download_url = _url_publica(request, "download_file", fname=out_name)
+    logger.info(f"[EXPORT] Job {job_id} en curso; descarga en: {download_url}")
 
     return JSONResponse(
-        {"download_url": download_url, "filename": out_path.name}
+        {"job_id": job_id, "status_url": status_url, "download_url": download_url, "filename": out_name},
+        status_code=202,
+    )
+
+@app.get("/status/{job_id}")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado.")
+    return {"job_id": job_id, **job}
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DOWNLOAD_NAME_RE = re.compile(r"Flora_[\w\-]+\.xlsx")   # mismo formato que _nombre_salida
+
+@app.get("/download/{fname}")
+async def download_file(fname: str):
+    # solo xlsx generados por /export (nada de rutas, "..", ni temporales)
+    if not DOWNLOAD_NAME_RE.fullmatch(fname):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado.")
+    file_path = DOWNLOAD_DIR / fname
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado.")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado.")
+
+    # pasamos el stat ya hecho para que Starlette no lo repita antes del envío
+    return FileResponse(
+        file_path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=fname,
+        stat_result=stat_result,
     )
 
 